@@ -14,13 +14,103 @@
 
 import hou
 import math
+import numpy as np
 import os
+import re
 import sys
 import toolutils
 import webbrowser
 
 from hutil.Qt import QtCore, QtGui, QtWidgets
 
+KEY_INTERPOLATIONS = ("bezier", "constant", "cubic", "cycle", "cyclet", "ease", "easein", "easeinp", "easeout", "easeoutp", "easep", 
+                      "linear", "match", "matchin", "matchout", "qlinear", "quintic", "repeat", "repeatt", "spline", "vmatch", "vmatchin", "vmatchout")
+LAYER_SUFFIX = re.compile(r'\s*\+\s*ch\("/obj/InBetween_layer/[^"]*"\)$')
+
+class SpacingChart(QtWidgets.QWidget):
+    def __init__(self, parent):
+        """Define the chart of per-frame spacing of the selected controls."""
+        QtWidgets.QWidget.__init__(self, parent)
+        self.setMinimumHeight(90)
+        self.frames = np.zeros(0)
+        self.curves = []
+        self.keyFrames = np.zeros(0)
+        self.currentFrame = hou.frame()
+        self.pixmap = None
+
+    def setData(self, frames, displacement, velocity, acceleration, keyFrames):
+        """Store new chart data and drop the rendered pixmap.
+
+        INPUTS:
+        frames -- array of sampled frames
+        displacement -- accumulated travelled distance per frame
+        velocity -- travelled distance between neighbour frames
+        acceleration -- change of velocity per frame
+        keyFrames -- array of key frames in ascending order
+        """
+        self.frames = frames
+        self.curves = [(displacement, QtGui.QColor(150, 150, 150)), (velocity, QtGui.QColor(230, 140, 20)), (acceleration, QtGui.QColor(86, 117, 167))]
+        self.keyFrames = keyFrames
+        self.pixmap = None
+        self.update()
+
+    def setFrame(self, frame):
+        """Move the current frame marker."""
+        self.currentFrame = frame
+        self.update()
+
+    def resizeEvent(self, event):
+        """Drop the rendered pixmap on resize."""
+        self.pixmap = None
+
+    def frameToX(self, frame):
+        """Convert a frame to a horizontal widget coordinate."""
+        if len(self.frames) < 2:
+            return 0
+        return float(frame - self.frames[0]) / (self.frames[-1] - self.frames[0]) * (self.width() - 1)
+
+    def drawFrameLine(self, painter, frame):
+        """Draw a vertical line at a given frame."""
+        painter.drawLine(QtCore.QLineF(self.frameToX(frame), 0, self.frameToX(frame), self.height()))
+
+    def renderPixmap(self):
+        """Render key lines and all curves into a pixmap."""
+        self.pixmap = QtGui.QPixmap(self.size())
+        self.pixmap.fill(QtGui.QColor(40, 40, 40))
+        painter = QtGui.QPainter(self.pixmap)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(QtGui.QColor(70, 70, 70))
+        for frame in self.keyFrames:
+            self.drawFrameLine(painter, frame)
+        height = self.height() - 6
+        xs = [self.frameToX(frame) for frame in self.frames]
+        for values, color in self.curves:
+            if len(values) < 2:
+                continue
+            low = values.min()
+            scale = values.max() - low
+            ys = 3 + height - (values - low) / (scale if scale > 0 else 1.0) * height
+            painter.setPen(color)
+            painter.drawPolyline(QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in zip(xs, ys.tolist())]))
+        painter.end()
+
+    def paintEvent(self, event):
+        """Paint the cached pixmap, the current frame and its neighbour keys."""
+        if self.pixmap is None:
+            self.renderPixmap()
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+        index = np.searchsorted(self.keyFrames, self.currentFrame)
+        painter.setPen(QtGui.QColor(130, 80, 10))
+        if index > 0:
+            self.drawFrameLine(painter, self.keyFrames[index - 1])
+        if index < len(self.keyFrames) and self.keyFrames[index] == self.currentFrame:
+            index += 1
+        if index < len(self.keyFrames):
+            self.drawFrameLine(painter, self.keyFrames[index])
+        painter.setPen(QtGui.QColor(220, 220, 220))
+        self.drawFrameLine(painter, self.currentFrame)
+
 class BreakdownKeysInterface(QtWidgets.QWidget):
     def __init__(self, paneTab):
         """Define all the elements of the user interface."""
@@ -29,6 +119,20 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         self.factor = 100
         self.mouseX = 0
         self.mouseY = 0
+        self.outlineGhosts = False
+        self.tangentMode = "auto"
+        self.bakeTolerance = 0.005
+        self.breakdownTarget = "keys"
+        self.poseCache = {}
+        self.blendPose = None
+        self.worldPose = None
+        self.layerMode = False
+        self.layerRange = (0, 0, 1)
+        self.layerSnapshot = None
+        self.trailsEnabled = False
+        self.trailCache = {}
+        self.trailDrawables = []
+        self.animationSignature = None
         hou.playbar.addEventCallback(self.outputPlaybarEvent)
         
         self.icons_path = hou.findDirectory('python_panels')+'/InBetween_icons/'
@@ -150,6 +254,25 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         self.selectionSet.clicked.connect(self.createNewSelectionSet)
         self.selectionSet.setToolTip('Creates selection set.')                          
         
+        self.timingLabel = QtWidgets.QLabel(self)
+        self.timingLabel.setText('Overlap')
+        self.timingSlider = QtWidgets.QSlider(QtCore.Qt.Horizontal, self)
+        self.timingSlider.setTickPosition(QtWidgets.QSlider.TicksBelow)
+        self.timingSlider.setStyleSheet("QSlider:handle {width: 14px;}")
+        self.timingSlider.setTickInterval(1)
+        self.timingSlider.setMinimum(-12)
+        self.timingSlider.setMaximum(12)
+        self.timingSlider.setValue(0)
+        self.timingSlider.setSingleStep(1)
+        self.timingSlider.setToolTip('Delays keys of every next control down the chain by the given number of frames.')
+        self.timingWidget = QtWidgets.QWidget(self)
+        self.timingLayout = QtWidgets.QHBoxLayout(self.timingWidget)
+        self.timingLayout.setContentsMargins(0, 0, 0, 0)
+        self.timingLayout.addWidget(self.timingLabel)
+        self.timingLayout.addWidget(self.timingSlider)
+        self.timingWidget.setVisible(False)
+        self.timingSnapshot = []
+        
         self.grid_left = QtWidgets.QGridLayout()
         self.grid_left.addWidget(self.delGhostBtn, 0, 0)
         self.grid_left.addWidget(self.makeGhostBtn, 0, 1)
@@ -175,14 +298,41 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         self.layout.addWidget(self.valueSlider)
         self.layout.addLayout(self.copyLabelLayout)
         self.layout.addLayout(self.bottomLayout)
+        self.layout.addWidget(self.timingWidget)
+        self.spacingChart = SpacingChart(self)
+        self.spacingChart.setVisible(False)
+        self.layout.addWidget(self.spacingChart)
         self.layout.setSpacing(8)
         self.valueSlider.valueChanged.connect(self.sliderVal)
         self.valueSlider.sliderMoved.connect(self.repaintValue)
+        self.valueSlider.sliderMoved.connect(self.previewLayer)
+        self.valueSlider.sliderPressed.connect(self.captureBlend)
         self.valueSlider.sliderReleased.connect(self.setBetweenKey)
         self.ghostSlider.valueChanged.connect(self.ghostWidth)
+        self.timingSlider.sliderPressed.connect(self.timingPressed)
+        self.timingSlider.sliderMoved.connect(self.timingMoved)
+        self.timingSlider.sliderReleased.connect(self.timingReleased)
         self.setLayout(self.layout)
         self.layout.setContentsMargins(10, 10, 10, 10)
         
+    def enterEvent(self, event):
+        """Refresh motion trails and the spacing chart when the cursor comes back to the panel after the selection or its keys changed."""
+        if not self.trailsEnabled and not self.spacingChart.isVisible():
+            return
+        if self.animationFingerprint() != self.animationSignature:
+            self.keysEdited()
+
+    def closeEvent(self, event):
+        """Remove callbacks and drawables of the panel."""
+        self.removeCallbacks()
+        QtWidgets.QWidget.closeEvent(self, event)
+
+    def removeCallbacks(self):
+        """Stop listening to the playbar and remove motion trails from the viewer."""
+        if self.outputPlaybarEvent in hou.playbar.eventCallbacks():
+            hou.playbar.removeEventCallback(self.outputPlaybarEvent)
+        self.clearMotionTrails()
+
     def repaintValue(self):
         """Repaint interface on slider move."""
         self.repaint()
@@ -256,10 +406,36 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         steppedAct = contextMenu.addAction("Convert to Stepped")
         linearAct = contextMenu.addAction("Convert to Linear")
         splinesAct = contextMenu.addAction("Convert to Bezier")
+        targetMenu = contextMenu.addMenu("Breakdown Target")
+        targetActs = {}
+        for target, label in (("keys", "Neighbour Keys"), ("world", "World Space Keys"), ("rest", "Rest Pose"), ("buffer", "Pose Buffer")):
+            targetActs[target] = targetMenu.addAction(label)
+            targetActs[target].setCheckable(True)
+            targetActs[target].setChecked(self.breakdownTarget == target)
+        capturePose = contextMenu.addAction("Capture Pose to Buffer")
+        layerMode = contextMenu.addAction("Offset Layer")
+        layerMode.setCheckable(True)
+        layerMode.setChecked(self.layerMode)
+        collapseLayer = contextMenu.addAction("Collapse Offset Layer")
+        tangentMenu = contextMenu.addMenu("Tangents")
+        tangentActs = {}
+        for mode in ("auto", "flat", "clamped", "spline"):
+            tangentActs[mode] = tangentMenu.addAction(mode.capitalize())
+            tangentActs[mode].setCheckable(True)
+            tangentActs[mode].setChecked(self.tangentMode == mode)
         contextMenu.addSeparator()
         cleanCurves = contextMenu.addAction("Clean Curves")
+        bakeChannels = contextMenu.addAction("Bake Channels")
+        retimeKeys = contextMenu.addAction("Retime Keys...")
+        overlapSlider = contextMenu.addAction("Toggle Overlap Slider")
         contextMenu.addSeparator()
         killAllGhosts = contextMenu.addAction("Kill All Ghosts")
+        outlineGhosts = contextMenu.addAction("Outline Ghosts")
+        outlineGhosts.setCheckable(True)
+        outlineGhosts.setChecked(self.outlineGhosts)
+        contextMenu.addSeparator()
+        motionTrail = contextMenu.addAction("Toggle Motion Trail")
+        spacingChart = contextMenu.addAction("Toggle Spacing Chart")
         action = contextMenu.exec_(QtGui.QCursor.pos())
         
         if action == steppedAct:
@@ -274,12 +450,49 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
             type = "bezier"
             self.convertAllKeys(type)
             
+        for target in targetActs:
+            if action == targetActs[target]:
+                self.breakdownTarget = target
+                self.repaint()
+            
+        if action == capturePose:
+            self.capturePoseBuffer()
+            
+        if action == layerMode:
+            self.toggleLayerMode()
+            
+        if action == collapseLayer:
+            self.collapseLayer()
+            
+        for mode in tangentActs:
+            if action == tangentActs[mode]:
+                self.tangentMode = mode
+                self.applyTangents()
+            
         if action == cleanCurves:         
             self.cleanCurves()
             
+        if action == bakeChannels:
+            self.bakeChannels()
+            
+        if action == retimeKeys:
+            self.retimeDialog()
+            
+        if action == overlapSlider:
+            self.timingWidget.setVisible(not self.timingWidget.isVisible())
+            
         if action == killAllGhosts:         
             self.killAllGhosts()
             
+        if action == outlineGhosts:
+            self.outlineGhosts = not self.outlineGhosts
+            
+        if action == motionTrail:
+            self.toggleMotionTrails()
+            
+        if action == spacingChart:
+            self.toggleSpacingChart()
+            
     def cleanCurves(self):
         """Delete all the redundant keys on all animated parameters of all selected objects.""" 
         nodes = hou.selectedNodes()
@@ -294,6 +507,158 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                                 parm.deleteKeyframeAtFrame(key.frame())
             self.convertAllKeys("bezier")
             
+    def isBakeable(self, parm):
+        """Check if a parameter is driven by an expression or a constraint instead of editable keys.
+
+        INPUTS:
+        parm -- parameter to check
+
+        OUTPUTS:
+        bakeable -- True if the parameter should be baked
+        """
+        if parm.getReferencedParm() != parm or type(parm.eval()) != float or parm.isLocked():
+            return False
+        keys = parm.keyframes()
+        if len(keys) > 0:
+            return any(key.expression().split("(")[0].strip() not in KEY_INTERPOLATIONS for key in keys)
+        return parm.overrideTrack() is not None or parm.isTimeDependent()
+
+    def evaluateHermite(self, key_frames, key_values, slopes, frames):
+        """Evaluate a curve of keys with one third handles at the given frames.
+
+        INPUTS:
+        key_frames -- key frames in ascending order
+        key_values -- key values
+        slopes -- key slopes in value per frame
+        frames -- frames to evaluate
+
+        OUTPUTS:
+        values -- array of curve values
+        """
+        index = np.clip(np.searchsorted(key_frames, frames, side='right') - 1, 0, len(key_frames) - 2)
+        span = key_frames[index + 1] - key_frames[index]
+        s = (frames - key_frames[index]) / span
+        s2 = s * s
+        s3 = s2 * s
+        return ((2 * s3 - 3 * s2 + 1) * key_values[index] + (s3 - 2 * s2 + s) * span * slopes[index] +
+                (3 * s2 - 2 * s3) * key_values[index + 1] + (s3 - s2) * span * slopes[index + 1])
+
+    def reduceKeys(self, frames, values, tolerance):
+        """Pick the keys needed to follow sampled values within a tolerance.
+
+        Starting with the first and the last sample, the worst sample of every segment
+        that is off by more than the tolerance becomes a key, until the curve through the
+        keys with slopes measured from the samples fits all samples.
+
+        INPUTS:
+        frames -- array of sampled frames
+        values -- array of sampled values
+        tolerance -- maximal allowed difference between the curve and the samples
+
+        OUTPUTS:
+        indices -- array of samples to key
+        slopes -- array of slopes of all samples in value per frame
+        """
+        slopes = np.gradient(values, frames) if len(frames) > 1 else np.zeros(len(frames))
+        keep = np.zeros(len(frames), dtype=bool)
+        keep[0] = keep[-1] = True
+        while keep.sum() > 1:
+            key_frames = frames[keep]
+            key_values = values[keep]
+            errors = np.abs(self.evaluateHermite(key_frames, key_values, slopes[keep], frames) - values)
+            errors[keep] = 0
+            if errors.max() <= tolerance:
+                break
+            segments = np.searchsorted(key_frames, frames, side='right') - 1
+            order = np.lexsort((errors, segments))
+            last = np.ones(len(order), dtype=bool)
+            last[:-1] = segments[order][1:] != segments[order][:-1]
+            worst = order[last]
+            keep[worst[errors[worst] > tolerance]] = True
+        return np.flatnonzero(keep), slopes
+
+    def bakeChannels(self):
+        """Bake expression and constraint driven parameters of the selected objects into reduced keys.
+
+        Constrained objects are baked from their world transforms solved back to translate,
+        rotate and scale. Constraints are turned off once their motion is keyed, and so are
+        CHOP exports which drive nothing but the baked parameters.
+        """
+        nodes = hou.selectedNodes()
+        frames = self.trailFrames()
+        parms = []
+        samples = []
+        constrained = []
+        exports = []
+        for node in nodes:
+            if isinstance(node, hou.ObjNode) and node.parm("constraints_on") and node.evalParm("constraints_on") and node.evalParm("constraints_path"):
+                constrained.append(node)
+        for node in constrained: #solve constrained world motion to local channels frame by frame
+            parent = node.inputs()[0] if node.inputs() else node.parent() if isinstance(node.parent(), hou.ObjNode) else None
+            pre = np.linalg.inv(self.matrixArray([node.preTransform()])[0])
+            rotate = node.evalParmTuple("r")
+            values = []
+            for frame in frames:
+                time = hou.frameToTime(frame)
+                local = self.matrixArray([node.worldTransformAtTime(time)])[0]
+                if parent is not None:
+                    local = np.matmul(local, np.linalg.inv(self.matrixArray([parent.worldTransformAtTime(time)])[0]))
+                solved = self.explodeLocal(node, np.matmul(local, pre), rotate)
+                rotate = solved["r"]
+                values.append(np.concatenate((solved["t"], solved["r"], solved["s"])))
+            values = np.array(values).T
+            for i, parm in enumerate([parm for name in ("t", "r", "s") for parm in node.parmTuple(name)]):
+                if not parm.isLocked():
+                    parms.append(parm)
+                    samples.append(values[i])
+        driven = [parm for node in nodes for parm in node.parms() if parm not in parms and self.isBakeable(parm)]
+        if parms == [] and driven == []:
+            return
+        driven_samples = np.empty((len(driven), len(frames)))
+        for j, frame in enumerate(frames):
+            for i, parm in enumerate(driven):
+                driven_samples[i, j] = parm.evalAsFloatAtFrame(frame)
+        parms += driven
+        samples += list(driven_samples)
+        with hou.undos.group("Bake Channels"):
+            for parm, values in zip(parms, samples):
+                tolerance = max(np.ptp(values) * self.bakeTolerance, 1e-5)
+                keep, slopes = self.reduceKeys(frames, values, tolerance)
+                parm.deleteAllKeyframes()
+                self.writeChannel(parm, frames[keep].tolist(), values[keep].tolist(), ["bezier()"] * len(keep), slopes[keep])
+                track = parm.overrideTrack()
+                if track is not None and track.chopNode() not in exports:
+                    exports.append(track.chopNode())
+            shared = []
+            for chop in exports:
+                if all(parm in parms for parm in self.exportedParms(chop)):
+                    chop.setExportFlag(False)
+                else:
+                    shared.append(chop.path())
+            for node in constrained:
+                node.parm("constraints_on").set(0)
+        self.keysEdited()
+        if shared:
+            hou.ui.displayMessage("Baked channels are still overridden by CHOPs which drive other parameters too:\n" + "\n".join(shared), 
+                                  severity=hou.severityType.Warning, title="Bake Channels")
+
+    def exportedParms(self, chop):
+        """Return all object level parameters overridden by a given CHOP node.
+
+        INPUTS:
+        chop -- CHOP node with the export flag on
+
+        OUTPUTS:
+        parms -- list of overridden parameters
+        """
+        parms = []
+        for node in hou.node("/obj").allSubChildren():
+            for parm in node.parms():
+                track = parm.overrideTrack()
+                if track is not None and track.chopNode() == chop:
+                    parms.append(parm)
+        return parms
+
     def killAllGhosts(self):
         """Delete hidden obj containing all ghosts.""" 
         if hou.node("/obj/InBetween_ghost_folder"):
@@ -324,6 +689,7 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         
     def outputPlaybarEvent(self, event_type, frame):
         """Change the color of UI color label in accordance with the ghost in current frame.""" 
+        self.spacingChart.setFrame(frame)
         ghost_mat_folder = hou.node("/obj/InBetween_ghost_folder/ghost_shaders/")
         if ghost_mat_folder:
             for shader in ghost_mat_folder.children():
@@ -477,9 +843,10 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         else:
             pose_favor_ratio = str(abs(self.sliderVal())) + "%" 
                 
-        painter.drawText(self.width()/30+12, pos.y()-10, "Prev Pose")
+        target_labels = {"keys": ("Prev Pose", "Next Pose"), "world": ("Prev Pose", "Next Pose"), "rest": ("Push", "Rest Pose"), "buffer": ("Push", "Buffer")}
+        painter.drawText(self.width()/30+12, pos.y()-10, target_labels[self.breakdownTarget][0])
         painter.drawText(QtCore.QPoint(self.width()/2, pos.y()-10), pose_favor_ratio)
-        painter.drawText(self.width()*0.82-10, pos.y()-10, "Next Pose")      
+        painter.drawText(self.width()*0.82-10, pos.y()-10, target_labels[self.breakdownTarget][1])      
         value_color = QtGui.QColor(self.factor*0.1, self.factor*0.1, self.factor * 0.1)
         painter.setBrush(value_color)
         painter.setPen(value_color)
@@ -517,16 +884,148 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         OUTPUTS:
         newKey -- converted key
         """ 
-        newKey = hou.Keyframe() #instantiate new keyframe object
-        newKey.setFrame(key.frame()) #set frame for the new key
-        newKey.setValue(key.value())
-        newKey.setExpression(exp_type + "()") #set key interpolation 
-        newKey.setSlopeAuto(True)
-        newKey.setInSlopeAuto(True)
-        param = param.getReferencedParm()         
+        param = param.getReferencedParm()
+        newKey = [oldKey for oldKey in param.keyframesAfter(key.frame()) if oldKey.frame() == key.frame()][0] #keep slopes and values of the key
+        newKey.setExpression(exp_type + "()" + self.layerSuffix(newKey.expression())) #set key interpolation
         param.setKeyframe(newKey)
         return newKey
     
+    def solveSlopes(self, frames, values, mode):
+        """Calculate slopes for all keys of a channel at once.
+
+        INPUTS:
+        frames -- key frames in ascending order
+        values -- key values
+        mode -- "auto", "flat", "clamped" or "spline"
+
+        OUTPUTS:
+        slopes -- array of slopes in value per frame
+        """
+        frames = np.asarray(frames, dtype=float)
+        values = np.asarray(values, dtype=float)
+        slopes = np.zeros(len(frames))
+        if len(frames) < 2 or mode == "flat":
+            return slopes
+        spans = np.diff(frames)
+        secants = np.diff(values) / spans
+        monotone = secants[:-1] * secants[1:] > 0
+        if mode == "clamped": #weighted harmonic mean never overshoots the neighbour keys
+            before = 2 * spans[1:] + spans[:-1]
+            after = spans[1:] + 2 * spans[:-1]
+            safe_prev = np.where(monotone, secants[:-1], 1.0)
+            safe_next = np.where(monotone, secants[1:], 1.0)
+            slopes[1:-1] = np.where(monotone, (before + after) / (before / safe_prev + after / safe_next), 0.0)
+        else:
+            slopes[1:-1] = (values[2:] - values[:-2]) / (frames[2:] - frames[:-2])
+            if mode == "auto": #flatten the extremes
+                slopes[1:-1][~monotone] = 0.0
+            else:
+                slopes[0] = secants[0]
+                slopes[-1] = secants[-1]
+        return slopes
+
+    def channelArrays(self, param):
+        """Read all keys of a parameter.
+
+        INPUTS:
+        param -- animated parameter
+
+        OUTPUTS:
+        frames -- list of key frames
+        values -- list of key values
+        expressions -- list of key expressions
+        """
+        keys = param.keyframes()
+        frames = [key.frame() for key in keys]
+        values = [key.value() for key in keys]
+        expressions = [key.expression() for key in keys]
+        return frames, values, expressions
+
+    def writeChannel(self, param, frames, values, expressions, slopes=None):
+        """Write all keys of a parameter with solved slopes in one pass, replacing any tangents set before.
+
+        Slopes and handles are written tied, so the keys can be solved again later.
+
+        INPUTS:
+        param -- parameter to set keys on
+        frames -- key frames in ascending order
+        values -- key values
+        expressions -- key expressions
+        slopes -- key slopes in value per frame, solved with the tangent mode if None
+
+        OUTPUTS:
+        keys -- tuple of written keys
+        """
+        fps = hou.fps()
+        if slopes is None:
+            slopes = self.solveSlopes(frames, values, self.tangentMode)
+        slopes = np.asarray(slopes, dtype=float) * fps
+        spans = np.diff(np.asarray(frames, dtype=float)) / fps / 3
+        keys = []
+        for i, frame in enumerate(frames):
+            key = hou.Keyframe()
+            key.setFrame(frame)
+            key.setValue(values[i])
+            key.setExpression(expressions[i])
+            key.setSlope(slopes[i])
+            if len(spans) > 0:
+                key.setAccel(min(spans[min(i, len(spans) - 1)], spans[max(i - 1, 0)])) #tied handles have to fit the shorter span
+            keys.append(key)
+        param.setKeyframes(keys)
+        return tuple(keys)
+
+    def setChannelKey(self, param, frame, value):
+        """Add or replace a key on a parameter, solving slopes of the key and its direct neighbours only.
+
+        Neighbours with broken or automatic slopes are left to the animator and Houdini.
+
+        INPUTS:
+        param -- parameter to set a new keyframe on
+        frame -- frame of the new key
+        value -- value of the new key
+        """
+        before = [key for key in param.keyframesBefore(frame)[-3:] if key.frame() < frame][-2:]
+        after = [key for key in param.keyframesAfter(frame)[:3] if key.frame() > frame][:2]
+        existing = [key for key in param.keyframesAfter(frame)[:1] if key.frame() == frame]
+        if existing:
+            key = existing[0]
+        else:
+            key = hou.Keyframe()
+            key.setFrame(frame)
+            key.setExpression(before[-1].expression() if before else after[0].expression() if after else "bezier()")
+        key.setValue(value)
+        window = before + [key] + after
+        fps = hou.fps()
+        slopes = self.solveSlopes([item.frame() for item in window], [item.value() for item in window], self.tangentMode) * fps
+        index = len(before)
+        changed = [key]
+        if existing == [] or key.isSlopeTied(): #setInSlope would untie the slope
+            key.setSlope(slopes[index])
+        if existing == []:
+            spans = [frame - item.frame() for item in before[-1:]] + [item.frame() - frame for item in after[:1]]
+            if spans:
+                key.setAccel(min(spans) / fps / 3) #tied handles have to fit the shorter span
+        for offset in (-1, 1):
+            if 0 <= index + offset < len(window):
+                neighbour = window[index + offset]
+                if neighbour.isSlopeTied() and not neighbour.isSlopeAuto():
+                    neighbour.setSlope(slopes[index + offset])
+                if existing == [] and (offset == -1 or neighbour.isAccelTied()):
+                    neighbour.setAccel(min(neighbour.accel(), abs(frame - neighbour.frame()) / fps / 3))
+                elif existing == []:
+                    neighbour.setInAccel(min(neighbour.inAccel(), (neighbour.frame() - frame) / fps / 3))
+                changed.append(neighbour)
+        param.setKeyframes(changed)
+
+    def applyTangents(self):
+        """Re-solve slopes of all keys of the selected objects with the current tangent mode."""
+        with hou.undos.group("Set Tangents"):
+            for node in hou.selectedNodes():
+                for parm in self.animatedParms(node):
+                    frames, values, expressions = self.channelArrays(parm)
+                    self.writeChannel(parm, frames, values, expressions)
+        self.keysEdited()
+
     def getValueFromConstant(self, param):
         """Get new frame value after conversion to linear and convert back to constant type.
         
@@ -542,7 +1041,7 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         exp_type = "linear"
         self.convertKeys(prevKey, param, exp_type)
         self.convertKeys(nextKey, param, exp_type)
-        value = param.eval()
+        value = self.baseEval(param)
         exp_type = "constant"
         self.convertKeys(prevKey, param, exp_type)
         self.convertKeys(nextKey, param, exp_type)
@@ -563,17 +1062,17 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         prevKey = param.keyframesBefore(currentFrame)[-1] #get value from the previous key
         nextKey = param.keyframesAfter(currentFrame)[0] #get value from the next key
         
-        if prevKey.expression() == "constant()" or nextKey.expression() == "constant()": #if keyframe type is constant
+        if self.baseExpression(prevKey.expression()) == "constant()" or self.baseExpression(nextKey.expression()) == "constant()": #if keyframe type is constant
             calculatedValue = self.getValueFromConstant(param) #convert nieghbours to linear and get current parameter value
         else:    
-            calculatedValue = param.eval() #set the new key value to current parameter value
+            calculatedValue = self.baseEval(param) #set the new key value to current parameter value
         
         if coef > 0:
             calculatedValue += (nextKey.value() - calculatedValue) * abs(coef)
         elif coef < 0:
             calculatedValue -= (calculatedValue - prevKey.value()) * abs(coef)
         else:
-            calculatedValue = param.eval()
+            calculatedValue = self.baseEval(param)
         
         return calculatedValue
             
@@ -592,18 +1091,164 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         
         #check if there's only one nieghbour key or no keys
         if keysBefore == () or keysAfter == ():
-            betweenKeyValue = param.eval()
+            betweenKeyValue = self.baseEval(param)
             
         #check if there's a key at current frame and no neighbour
         elif (keysBefore[-1].frame() == currentFrame and len(keysBefore) == 1) or (keysAfter[0].frame() == currentFrame and len(keysAfter) == 1):
-            betweenKeyValue = param.eval()
+            betweenKeyValue = self.baseEval(param)
         else:
             betweenKeyValue = self.calculateValue(param)
         
         return betweenKeyValue
         
+    def matrixArray(self, matrices):
+        """Convert hou.Matrix4 objects to an array of shape (matrices, 4, 4)."""
+        return np.array([matrix.asTuple() for matrix in matrices], dtype=float).reshape(-1, 4, 4)
+
+    def rotationsToQuaternions(self, rotations):
+        """Convert an array of (3, 3) rotation matrices to (w, x, y, z) quaternions.
+
+        Shepperd's method: the largest of w, x, y and z is taken from the diagonal and the others
+        from the symmetric and antisymmetric sums, which stays exact for half turns.
+        """
+        m = rotations
+        diagonal = np.column_stack((m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2], m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]))
+        case = np.argmax(diagonal, axis=1)
+        sums = {"w": (m[:, 2, 1] - m[:, 1, 2], m[:, 0, 2] - m[:, 2, 0], m[:, 1, 0] - m[:, 0, 1]),
+                "x": (m[:, 2, 1] - m[:, 1, 2], m[:, 0, 1] + m[:, 1, 0], m[:, 0, 2] + m[:, 2, 0]),
+                "y": (m[:, 0, 2] - m[:, 2, 0], m[:, 0, 1] + m[:, 1, 0], m[:, 1, 2] + m[:, 2, 1]),
+                "z": (m[:, 1, 0] - m[:, 0, 1], m[:, 0, 2] + m[:, 2, 0], m[:, 1, 2] + m[:, 2, 1])}
+        quaternions = np.zeros((len(m), 4))
+        for i, name in enumerate(("w", "x", "y", "z")):
+            rows = case == i
+            largest = np.sqrt(np.maximum(0.0, 1 + 2 * diagonal[rows, i] - diagonal[rows, 0] if i else 1 + diagonal[rows, 0])) / 2
+            others = [j for j in range(4) if j != i]
+            quaternions[rows, i] = largest
+            for j, value in zip(others, sums[name]):
+                quaternions[rows, j] = value[rows] / (4 * largest)
+        return quaternions / np.linalg.norm(quaternions, axis=1)[:, np.newaxis]
+
+    def quaternionsToRotations(self, quaternions):
+        """Convert an array of (w, x, y, z) quaternions to (3, 3) rotation matrices."""
+        w, x, y, z = quaternions.T
+        return np.stack((np.column_stack((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w))),
+                         np.column_stack((2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w))),
+                         np.column_stack((2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)))), axis=1)
+
+    def blendTransforms(self, start, end, coef):
+        """Interpolate arrays of transforms with slerped rotation and linear translation and scale.
+
+        INPUTS:
+        start -- array of (4, 4) transforms
+        end -- array of (4, 4) transforms
+        coef -- blend amount from 0 to 1
+
+        OUTPUTS:
+        transforms -- array of blended (4, 4) transforms
+        """
+        start_scale = np.linalg.norm(start[:, :3, :3], axis=2)
+        end_scale = np.linalg.norm(end[:, :3, :3], axis=2)
+        start_scale[np.linalg.det(start[:, :3, :3]) < 0, 0] *= -1 #flip x of mirrored transforms to get a proper rotation, the scale restores it
+        end_scale[np.linalg.det(end[:, :3, :3]) < 0, 0] *= -1
+        q0 = self.rotationsToQuaternions(start[:, :3, :3] / start_scale[:, :, np.newaxis])
+        q1 = self.rotationsToQuaternions(end[:, :3, :3] / end_scale[:, :, np.newaxis])
+        dot = np.einsum('ij,ij->i', q0, q1)
+        q1[dot < 0] *= -1 #take the shortest arc
+        dot = np.clip(np.abs(dot), -1.0, 1.0)
+        angle = np.arccos(dot)
+        sine = np.sin(angle)
+        close = sine < 1e-6
+        w0 = np.where(close, 1 - coef, np.sin((1 - coef) * angle) / np.where(close, 1.0, sine))
+        w1 = np.where(close, coef, np.sin(coef * angle) / np.where(close, 1.0, sine))
+        quaternions = q0 * w0[:, np.newaxis] + q1 * w1[:, np.newaxis]
+        quaternions /= np.linalg.norm(quaternions, axis=1)[:, np.newaxis]
+        scale = start_scale + (end_scale - start_scale) * coef
+        transforms = np.zeros(start.shape)
+        transforms[:, :3, :3] = self.quaternionsToRotations(quaternions) * scale[:, :, np.newaxis]
+        transforms[:, 3, :3] = start[:, 3, :3] + (end[:, 3, :3] - start[:, 3, :3]) * coef
+        transforms[:, 3, 3] = 1.0
+        return transforms
+
+    def explodeLocal(self, node, transform, rotate):
+        """Solve a local transform of an object back to its translate, rotate and scale parameters.
+
+        INPUTS:
+        node -- object the transform belongs to
+        transform -- (4, 4) local transform without the pre-transform
+        rotate -- rotations to keep the solved ones continuous with
+
+        OUTPUTS:
+        values -- dictionary of "t", "r" and "s" value arrays
+        """
+        components = hou.Matrix4(transform.tolist()).explode(transform_order=node.parm("xOrd").evalAsString(), 
+                        rotate_order=node.parm("rOrd").evalAsString(), pivot=hou.Vector3(node.evalParmTuple("p")))
+        values = {"t": np.array(components["translate"]), "r": np.array(components["rotate"]), "s": np.array(components["scale"]) / node.evalParm("scale")}
+        values["r"] += 360 * np.round((np.array(rotate) - values["r"]) / 360)
+        return values
+
+    def captureWorld(self):
+        """Evaluate world transforms of the selected objects at the current and neighbour key frames in one pass."""
+        currentFrame = hou.frame()
+        nodes = []
+        prev_frames = []
+        next_frames = []
+        for node in self.chainOrder(hou.selectedNodes()):
+            parms = self.animatedParms(node)
+            if isinstance(node, hou.ObjNode) and parms:
+                frames = [key.frame() for parm in parms for key in parm.keyframes()]
+                nodes.append(node)
+                prev_frames.append(max([frame for frame in frames if frame < currentFrame] or [currentFrame]))
+                next_frames.append(min([frame for frame in frames if frame > currentFrame] or [currentFrame]))
+        current = self.matrixArray([node.worldTransform() for node in nodes])
+        prev = self.matrixArray([node.worldTransformAtTime(hou.frameToTime(frame)) for node, frame in zip(nodes, prev_frames)])
+        following = self.matrixArray([node.worldTransformAtTime(hou.frameToTime(frame)) for node, frame in zip(nodes, next_frames)])
+        parents = self.matrixArray([node.parentAndSubnetTransform() for node in nodes])
+        pre = self.matrixArray([node.preTransform() for node in nodes])
+        parent_index = []
+        for node in nodes: #nearest captured ancestor, unselected objects in between keep their local transforms
+            ancestors = [ancestor for ancestor in node.inputAncestors() if ancestor in nodes]
+            parent_index.append(nodes.index(max(ancestors, key=lambda ancestor: len(ancestor.inputAncestors()))) if ancestors else -1)
+        parent_index = np.array(parent_index, dtype=int)
+        return nodes, current, prev, following, parents, pre, parent_index
+
+    def setWorldKey(self):
+        """Set keys which blend the world transforms of the selection toward the neighbour key poses."""
+        if self.worldPose is None:
+            self.worldPose = self.captureWorld()
+        nodes, current, prev, following, parents, pre, parent_index = self.worldPose
+        self.worldPose = None
+        if nodes == []:
+            return
+        coef = float(self.valueSlider.value())/100
+        desired = self.blendTransforms(current, following if coef >= 0 else prev, abs(coef))
+        moved = parent_index >= 0
+        parents = parents.copy()
+        parents[moved] = np.matmul(np.matmul(parents[moved], np.linalg.inv(current[parent_index[moved]])), desired[parent_index[moved]]) #follow parents blended in the same pass
+        local = np.matmul(np.matmul(desired, np.linalg.inv(parents)), np.linalg.inv(pre))
+        currentFrame = hou.frame()
+        with hou.undos.group("Set World Key"):
+            for node, transform in zip(nodes, local):
+                values = self.explodeLocal(node, transform, node.evalParmTuple("r"))
+                for name in values:
+                    for parm, value in zip(node.parmTuple(name), values[name].tolist()):
+                        if parm.isLocked():
+                            continue
+                        value -= self.layerOffset(parm) #the key expression adds the offset layer back
+                        if len(parm.keyframes()) > 0 or abs(value - self.baseEval(parm)) > 1e-5: #key unanimated channels the blend has to move
+                            self.setChannelKey(parm, currentFrame, value)
+        self.keysEdited()
+
     def setBetweenKey(self):
         """Set a new key with the new value."""
+        if self.breakdownTarget == "world":
+            self.setWorldKey()
+            return
+        if self.layerMode:
+            self.setLayerOffset()
+            return
+        if self.breakdownTarget != "keys":
+            self.setBlendKey()
+            return
         controls = hou.selectedNodes() #initiate currently selected objects
         with hou.undos.group("Set Between Key"): #record changes as single action for one undo
             for control in controls: #iterate between selected objects
@@ -611,12 +1256,321 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                     parm = parm.getReferencedParm()
                     if len(parm.keyframes()) > 0 and type(parm.eval()) == float: #if parameter is animated and its type is float
                         currentFrame = hou.frame() #get current frame number
-                        key = hou.Keyframe() #instantiate new keyframe object
-                        key.setFrame(currentFrame) #set frame for the new key
-                        key.setValue(self.getBetweenKeyValue(parm)) #set value for the new key
-                        key.setSlopeAuto(True)
-                        key.setInSlopeAuto(True)
-                        parm.setKeyframe(key) #set the new key on timeline
+                        self.setChannelKey(parm, currentFrame, self.getBetweenKeyValue(parm)) #set the new key on timeline
+        self.keysEdited()
+
+    def storePose(self, target, rig, parms, values):
+        """Store reference values of given parameters in the pose cache of a rig.
+
+        INPUTS:
+        target -- "rest" or "buffer"
+        rig -- path of the network containing the controls
+        parms -- parameters to store
+        values -- values of the parameters
+        """
+        cache = self.poseCache.setdefault((target, rig), {'index': {}, 'values': np.zeros(0)})
+        added = [parm.path() for parm in parms if parm.path() not in cache['index']]
+        for i, path in enumerate(added):
+            cache['index'][path] = len(cache['values']) + i
+        cache['values'] = np.concatenate((cache['values'], np.zeros(len(added))))
+        cache['values'][[cache['index'][parm.path()] for parm in parms]] = values
+
+    def referencePose(self, target, parms):
+        """Look up reference values of given parameters, capturing missing rest values once.
+
+        INPUTS:
+        target -- "rest" or "buffer"
+        parms -- parameters to look up
+
+        OUTPUTS:
+        values -- array of reference values
+        known -- array telling which parameters have a reference value
+        """
+        if target == "rest":
+            missing = {}
+            for parm in parms:
+                rig = parm.node().parent().path()
+                if parm.path() not in self.poseCache.get(("rest", rig), {'index': {}})['index']:
+                    missing.setdefault(rig, []).append(parm)
+            for rig in missing:
+                self.storePose("rest", rig, missing[rig], [parm.parmTemplate().defaultValue()[parm.componentIndex()] for parm in missing[rig]])
+        values = np.zeros(len(parms))
+        known = np.zeros(len(parms), dtype=bool)
+        for i, parm in enumerate(parms):
+            cache = self.poseCache.get((target, parm.node().parent().path()))
+            if cache is not None and parm.path() in cache['index']:
+                values[i] = cache['values'][cache['index'][parm.path()]]
+                known[i] = True
+        return values, known
+
+    def capturePoseBuffer(self):
+        """Capture the current pose of the selected objects into the pose buffer of their rig."""
+        rigs = {}
+        for node in hou.selectedNodes():
+            rigs.setdefault(node.parent().path(), []).extend(self.animatedParms(node))
+        for rig in rigs:
+            self.storePose("buffer", rig, rigs[rig], [self.baseEval(parm) for parm in rigs[rig]])
+
+    def captureBlend(self):
+        """Capture current and reference poses of the selection before dragging toward a pose."""
+        self.blendPose = None
+        self.worldPose = None
+        self.layerSnapshot = None
+        if self.breakdownTarget == "world":
+            self.worldPose = self.captureWorld()
+            return
+        if self.breakdownTarget == "keys" and not self.layerMode:
+            return
+        parms = []
+        for node in hou.selectedNodes():
+            parms.extend(self.animatedParms(node))
+        current = np.array([self.baseEval(parm) for parm in parms])
+        if self.layerMode:
+            self.layerSnapshot = self.captureLayer(parms)
+        if self.breakdownTarget == "keys":
+            currentFrame = hou.frame()
+            before = [[key.value() for key in parm.keyframesBefore(currentFrame) if key.frame() < currentFrame] for parm in parms]
+            after = [[key.value() for key in parm.keyframesAfter(currentFrame) if key.frame() > currentFrame] for parm in parms]
+            negative = np.array([values[-1] if values else current[i] for i, values in enumerate(before)])
+            positive = np.array([values[0] if values else current[i] for i, values in enumerate(after)])
+        else:
+            positive, known = self.referencePose(self.breakdownTarget, parms)
+            positive[~known] = current[~known]
+            negative = 2 * current - positive #negative values push the pose away from the reference
+        self.blendPose = (parms, current, positive, negative)
+
+    def blendValues(self):
+        """Blend the captured current pose toward the reference pose by the slider value.
+
+        OUTPUTS:
+        parms -- blended parameters
+        current -- array of current values
+        values -- array of blended values
+        """
+        if self.blendPose is None:
+            self.captureBlend()
+        parms, current, positive, negative = self.blendPose
+        coef = float(self.valueSlider.value())/100
+        target = positive if coef >= 0 else negative
+        return parms, current, current + (target - current) * abs(coef)
+
+    def setBlendKey(self):
+        """Set keys blended between the captured current pose and the reference pose."""
+        parms, current, values = self.blendValues()
+        currentFrame = hou.frame()
+        with hou.undos.group("Set Blend Key"):
+            for parm, value in zip(parms, values.tolist()):
+                self.setChannelKey(parm, currentFrame, value)
+        self.blendPose = None
+        self.keysEdited()
+
+    def layerParmName(self, parm):
+        """Return the name of the offset layer parameter of a given parameter.
+
+        Slashes become double underscores and other characters their hex code between underscores,
+        so different paths never share a name.
+        """
+        name = re.sub("[^0-9a-zA-Z/]", lambda match: "_%x_" % ord(match.group(0)), parm.path().strip("/"))
+        return "ib_" + name.replace("/", "__")
+
+    def layerSuffix(self, expression):
+        """Return the part of a key expression which adds the offset layer."""
+        match = LAYER_SUFFIX.search(expression)
+        return match.group(0) if match else ""
+
+    def baseExpression(self, expression):
+        """Return a key expression without the part which adds the offset layer."""
+        return expression[:len(expression) - len(self.layerSuffix(expression))]
+
+    def layerParm(self, parm):
+        """Return the offset layer parameter of a given parameter or None if it isn't layered."""
+        layer = hou.node("/obj/InBetween_layer")
+        if layer is None:
+            return None
+        layer_parm = layer.parm(self.layerParmName(parm))
+        if layer_parm is None or layer_parm.parmTemplate().tags().get("ib_layer_parm") != parm.path():
+            return None
+        return layer_parm
+
+    def layerOffset(self, parm, frame=None):
+        """Return the offset the layer adds to a given parameter.
+
+        INPUTS:
+        parm -- animated parameter
+        frame -- frame to evaluate, current frame if None
+
+        OUTPUTS:
+        offset -- offset value
+        """
+        layer_parm = self.layerParm(parm)
+        if layer_parm is None:
+            return 0.0
+        return layer_parm.evalAsFloatAtFrame(hou.frame() if frame is None else frame)
+
+    def baseEval(self, parm):
+        """Evaluate a parameter at the current frame without its layer offset."""
+        return parm.eval() - self.layerOffset(parm)
+
+    def setLayerOffset(self):
+        """Commit the offset layer of the selection from the captured blend as a single undo, leaving its keys as they are."""
+        parms, current, values = self.blendValues()
+        if self.layerSnapshot is not None:
+            with hou.undos.disabler():
+                self.restoreLayer(parms, self.layerSnapshot)
+        with hou.undos.group("Set Offset Layer"):
+            self.writeLayerOffset(parms, values - current)
+        self.layerSnapshot = None
+        self.blendPose = None
+        self.keysEdited()
+
+    def previewLayer(self, value):
+        """Preview the offset layer while dragging the main slider, without recording undos."""
+        if not self.layerMode or self.breakdownTarget == "world":
+            return
+        parms, current, values = self.blendValues()
+        with hou.undos.disabler():
+            self.writeLayerOffset(parms, values - current)
+
+    def writeLayerOffset(self, parms, offsets):
+        """Write the four keys of the offset layer of given parameters, adding the layer where it is missing.
+
+        INPUTS:
+        parms -- layered parameters
+        offsets -- array of offsets to hold inside the layer range
+        """
+        start, end, blend = self.layerRange
+        layer = hou.node("/obj/InBetween_layer")
+        if layer is None:
+            layer = hou.node('/obj').createNode('null', node_name='InBetween_layer')
+            layer.setColor(hou.Color((0.3,0.3,0.3)))
+            layer.setSelectableInViewport(0)
+            layer.hide(1)
+        for parm, offset in zip(parms, offsets.tolist()):
+            name = self.layerParmName(parm)
+            if layer.parm(name) is None:
+                layer.addSpareParmTuple(hou.FloatParmTemplate(name, parm.path(), 1, tags={"ib_layer_parm": parm.path()}))
+                keys = parm.keyframes()
+                for key in keys:
+                    key.setExpression(key.expression() + ' + ch("' + layer.parm(name).path() + '")')
+                parm.setKeyframes(keys)
+            layer.parm(name).deleteAllKeyframes()
+            self.writeChannel(layer.parm(name), [start - blend, start, end, end + blend], [0.0, offset, offset, 0.0], ["bezier()"] * 4)
+
+    def captureLayer(self, parms):
+        """Remember the offset layer of given parameters before dragging the main slider.
+
+        INPUTS:
+        parms -- parameters about to be layered
+
+        OUTPUTS:
+        snapshot -- (layer existed, list of layer keys or None for parameters without a layer)
+        """
+        layer_parms = [self.layerParm(parm) for parm in parms]
+        return hou.node("/obj/InBetween_layer") is not None, [layer_parm.keyframes() if layer_parm is not None else None for layer_parm in layer_parms]
+
+    def restoreLayer(self, parms, snapshot):
+        """Put the offset layer of given parameters back as captured, removing layers added by the preview.
+
+        INPUTS:
+        parms -- previewed parameters
+        snapshot -- captured layer from captureLayer
+        """
+        layer = hou.node("/obj/InBetween_layer")
+        if layer is None:
+            return
+        existed, layer_keys = snapshot
+        for parm, keys in zip(parms, layer_keys):
+            layer_parm = self.layerParm(parm)
+            if layer_parm is None:
+                continue
+            if keys is None:
+                base_keys = parm.keyframes()
+                for key in base_keys:
+                    key.setExpression(self.baseExpression(key.expression()))
+                parm.setKeyframes(base_keys)
+                layer.removeSpareParmTuple(layer_parm.tuple())
+            else:
+                layer_parm.deleteAllKeyframes()
+                layer_parm.setKeyframes(keys)
+        if not existed:
+            layer.destroy()
+
+    def collapseLayer(self):
+        """Add the offset layer to the keys of all layered parameters and remove the layer.
+
+        Base keys keep their tangents with the offset and its slope added on top,
+        new keys are only set where the layer itself has keys.
+        """
+        layer = hou.node("/obj/InBetween_layer")
+        if layer is None:
+            return
+        fps = hou.fps()
+        step = 0.01 #frame step to measure slopes of the layer
+        with hou.undos.group("Collapse Offset Layer"):
+            for layer_parm in layer.spareParms():
+                parm = hou.parm(layer_parm.parmTemplate().tags()["ib_layer_parm"])
+                if parm is None:
+                    continue
+                keys = list(parm.keyframes())
+                base_frames = [key.frame() for key in keys]
+                added = []
+                for frame in sorted(set(key.frame() for key in layer_parm.keyframes()) - set(base_frames)): #sample layered curve before touching the keys
+                    before = [key for key in keys if key.frame() < frame]
+                    key = hou.Keyframe()
+                    key.setFrame(frame)
+                    key.setValue(parm.evalAsFloatAtFrame(frame))
+                    key.setExpression(self.baseExpression((before[-1] if before else keys[0]).expression()) if keys else "bezier()")
+                    key.setSlope((parm.evalAsFloatAtFrame(frame + step) - parm.evalAsFloatAtFrame(frame - step)) / step / 2 * fps)
+                    added.append(key)
+                for key in keys:
+                    frame = key.frame()
+                    offset = layer_parm.evalAsFloatAtFrame(frame)
+                    in_slope = (offset - layer_parm.evalAsFloatAtFrame(frame - step)) / step * fps
+                    slope = (layer_parm.evalAsFloatAtFrame(frame + step) - offset) / step * fps
+                    if not key.isValueTied():
+                        key.setInValue(key.inValue() + offset)
+                    key.setValue(key.value() + offset)
+                    key.setExpression(self.baseExpression(key.expression()))
+                    if key.isSlopeAuto():
+                        continue
+                    if key.isSlopeTied(): #setInSlope would untie the slope
+                        key.setSlope(key.slope() + (in_slope + slope) / 2)
+                    else:
+                        key.setSlope(key.slope() + slope)
+                        key.setInSlope(key.inSlope() + in_slope)
+                keys = sorted(keys + added, key=lambda key: key.frame())
+                for i, key in enumerate(keys): #new keys split base segments, keep handles inside their spans
+                    if key not in added:
+                        continue
+                    spans = []
+                    if i > 0:
+                        spans.append((key.frame() - keys[i - 1].frame()) / fps / 3)
+                        keys[i - 1].setAccel(min(keys[i - 1].accel(), spans[-1]))
+                    if i < len(keys) - 1:
+                        spans.append((keys[i + 1].frame() - key.frame()) / fps / 3)
+                        if keys[i + 1].isAccelTied():
+                            keys[i + 1].setAccel(min(keys[i + 1].accel(), spans[-1]))
+                        else:
+                            keys[i + 1].setInAccel(min(keys[i + 1].inAccel(), spans[-1]))
+                    if spans:
+                        key.setAccel(min(spans)) #tied handles have to fit the shorter span
+                parm.deleteAllKeyframes()
+                parm.setKeyframes(keys)
+            layer.destroy()
+        self.keysEdited()
+
+    def toggleLayerMode(self):
+        """Turn the offset layer mode of the main slider on or off, asking for the layer range."""
+        if self.layerMode:
+            self.layerMode = False
+        else:
+            start, end = hou.playbar.playbackRange()
+            choice, values = hou.ui.readMultiInput('Offset layer range', ('Start', 'End', 'Blend'), buttons=('OK', 'Cancel'), 
+                                default_choice=0, close_choice=1, title='Offset Layer', initial_contents=(str(start), str(end), '5'))
+            if choice == 0:
+                self.layerRange = (float(values[0]), float(values[1]), max(float(values[2]), 1.0))
+                self.layerMode = True
+        self.repaint()
 
     def convertAllKeys(self, exp_type):
         """Convert all keys on all parameters to a given type.
@@ -630,8 +1584,8 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                 for parm in control.parms(): #for every object iterate between its parameters
                     parm = parm.getReferencedParm() 
                     if len(parm.keyframes()) > 0 and type(parm.eval()) == float and parm.isLocked() == False:               
-                        for key in parm.keyframes():
-                            self.convertKeys(key, parm, exp_type)
+                        frames, values, expressions = self.channelArrays(parm)
+                        self.writeChannel(parm, frames, values, [exp_type + "()" + self.layerSuffix(expression) for expression in expressions])
                                        
     def copyKeyframe(self, frame_step):
         """Copy all current keyframes on all selected objects to a specified frame.
@@ -646,14 +1600,11 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                 for parm in node.parms():
                     parm = parm.getReferencedParm()
                     if parm.keyframesBefore(current_frame) != () and len(parm.keyframes()) > 0 and type(parm.eval()) == float and parm.isLocked() == False:
-                        new_key = hou.Keyframe()
-                        new_key.setValue(parm.eval())
-                        new_key.setSlopeAuto(1)
-                        new_key.setFrame(current_frame + float(frame_step))
-                        parm.setKeyframe(new_key)
+                        self.setChannelKey(parm, current_frame + float(frame_step), self.baseEval(parm))
                     else:
                         pass
             hou.setFrame(current_frame + frame_step)
+        self.keysEdited()
         
     def copyToTwos(self):
         """Copy all current keyframes on all selected objects to a second frame after the current."""        
@@ -663,6 +1614,145 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
         """Copy all current keyframes on all selected objects to a fourth frame after the current.""" 
         self.copyKeyframe(4)
     
+    def chainOrder(self, nodes):
+        """Sort objects from the root of their hierarchy to its tip.
+
+        INPUTS:
+        nodes -- objects to sort
+
+        OUTPUTS:
+        nodes -- sorted list of objects
+        """
+        return sorted(nodes, key=lambda node: len(node.inputAncestors()))
+
+    def captureTiming(self):
+        """Capture keys of all animated parameters of the selected objects with their hierarchy level.
+
+        Objects at the same depth of the hierarchy share a level, so parallel chains
+        are delayed together.
+
+        OUTPUTS:
+        snapshot -- list of (parameter, keys, chain level, original key timing) tuples
+        """
+        nodes = hou.selectedNodes()
+        depths = sorted(set(len(node.inputAncestors()) for node in nodes))
+        snapshot = []
+        for node in self.chainOrder(nodes):
+            level = depths.index(len(node.inputAncestors()))
+            for parm in self.animatedParms(node):
+                keys = parm.keyframes()
+                timing = np.array([(key.frame(), key.inSlope(), key.slope(), key.inAccel(), key.accel()) for key in keys]).reshape(-1, 5)
+                snapshot.append((parm, keys, level, timing))
+        return snapshot
+
+    def retimeChannel(self, frames, offset, scale, pivot, start, end):
+        """Offset and scale keys of one channel inside a frame range.
+
+        Keys are snapped to whole frames. When several keys land on the same frame,
+        moved keys win over the ones outside of the range, and later keys win over earlier ones.
+
+        INPUTS:
+        frames -- key frames in ascending order
+        offset -- number of frames to move keys by
+        scale -- time scale around the pivot
+        pivot -- frame to scale around
+        start -- first frame of the retimed range
+        end -- last frame of the retimed range
+
+        OUTPUTS:
+        frames -- array of new frames of all keys
+        moving -- array telling which keys were moved
+        keep -- array of keys left after collisions, in their new order
+        """
+        frames = np.asarray(frames, dtype=float)
+        moving = (frames >= start) & (frames <= end)
+        new_frames = np.where(moving, np.round(pivot + (frames - pivot) * scale + offset), frames)
+        order = np.lexsort((moving, new_frames))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = new_frames[order][1:] != new_frames[order][:-1]
+        return new_frames, moving, order[last]
+
+    def retimeKeys(self, snapshot, offset, scale, cascade):
+        """Rewrite key times of all captured channels, one bulk write per channel.
+
+        Moved keys keep their values, expressions and tangents, with slopes divided
+        and handle lengths multiplied by the time scale.
+
+        INPUTS:
+        snapshot -- captured keys from captureTiming
+        offset -- number of frames to move keys by
+        scale -- time scale around the current frame
+        cascade -- additional offset for every next level of the chain
+        """
+        start, end = hou.playbar.playbackRange()
+        pivot = hou.frame()
+        for parm, keys, level, timing in snapshot:
+            frames, moving, keep = self.retimeChannel(timing[:, 0], offset + cascade * level, scale, pivot, start, end)
+            factor = np.where(moving, scale, 1.0)
+            for i in keep:
+                self.setKeyTiming(keys[i], frames[i], timing[i, 1:3] / factor[i], timing[i, 3:5] * factor[i])
+            parm.deleteAllKeyframes()
+            parm.setKeyframes([keys[i] for i in keep])
+
+    def restoreTiming(self, snapshot):
+        """Put captured keys back exactly as they were.
+
+        INPUTS:
+        snapshot -- captured keys from captureTiming
+        """
+        for parm, keys, level, timing in snapshot:
+            for key, row in zip(keys, timing):
+                self.setKeyTiming(key, row[0], row[1:3], row[3:5])
+            parm.deleteAllKeyframes()
+            parm.setKeyframes(keys)
+
+    def setKeyTiming(self, key, frame, slopes, accels):
+        """Move a key and set its tangents, leaving tied slopes and handles tied.
+
+        INPUTS:
+        key -- key to change
+        frame -- new frame of the key
+        slopes -- (in, out) slopes
+        accels -- (in, out) handle lengths
+        """
+        key.setFrame(frame)
+        if not key.isSlopeAuto():
+            key.setSlope(slopes[1])
+            if not key.isSlopeTied(): #setInSlope would untie the slope
+                key.setInSlope(slopes[0])
+        key.setAccel(accels[1])
+        if not key.isAccelTied():
+            key.setInAccel(accels[0])
+
+    def timingPressed(self):
+        """Capture keys of the selection before the overlap drag."""
+        self.timingSnapshot = self.captureTiming()
+
+    def timingMoved(self, value):
+        """Preview the overlap while dragging, without recording undos."""
+        with hou.undos.disabler():
+            self.retimeKeys(self.timingSnapshot, 0, 1, value)
+
+    def timingReleased(self):
+        """Commit the overlap as a single undo and reset the slider."""
+        value = self.timingSlider.value()
+        with hou.undos.disabler():
+            self.restoreTiming(self.timingSnapshot)
+        with hou.undos.group("Overlap Keys"):
+            self.retimeKeys(self.timingSnapshot, 0, 1, value)
+        self.timingSnapshot = []
+        self.timingSlider.setValue(0)
+        self.keysEdited()
+
+    def retimeDialog(self):
+        """Ask for offset, scale and cascade values and retime keys of the selection."""
+        choice, values = hou.ui.readMultiInput('Retime keys in the playback range', ('Offset', 'Scale', 'Cascade'), buttons=('OK', 'Cancel'), 
+                            default_choice=0, close_choice=1, title='Retime Keys', initial_contents=('0', '1', '0'))
+        if choice == 0:
+            with hou.undos.group("Retime Keys"):
+                self.retimeKeys(self.captureTiming(), float(values[0]), float(values[1]), float(values[2]))
+            self.keysEdited()
+
     def ghostShaderCreate(self, ghost_mat_folder, ghost_name):
         """Create a shader for a new ghost.
         
@@ -709,6 +1799,112 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                     mergedNodes.append(node)
         return mergedNodes
        
+    def outlineEdges(self, positions, vertex_points, vertex_prims, prim_closed, eye, crease_angle=60):
+        """Find boundary, crease and silhouette edges of a polygonal mesh.
+
+        INPUTS:
+        positions -- (points, 3) array of point positions
+        vertex_points -- point number of every vertex, ordered by primitive
+        vertex_prims -- primitive number of every vertex
+        prim_closed -- array telling which primitives are closed
+        eye -- camera position used to find silhouette edges, None to skip them
+        crease_angle -- minimal angle in degrees between face normals of a crease edge
+
+        OUTPUTS:
+        edges -- (edges, 2) array of point numbers
+        """
+        prim_count = len(prim_closed)
+        counts = np.bincount(vertex_prims, minlength=prim_count)
+        starts = np.cumsum(counts) - counts
+        following = np.arange(1, len(vertex_points) + 1)
+        closed = counts > 0
+        following[(starts + counts - 1)[closed]] = starts[closed]
+        a = vertex_points.astype(np.int64)
+        b = a[following]
+        open_ends = np.zeros(len(a), dtype=bool)
+        open_ends[(starts + counts - 1)[closed & ~prim_closed]] = True #open polylines have no closing edge
+
+        face_cross = np.cross(positions[a], positions[b])
+        normals = np.column_stack([np.bincount(vertex_prims, face_cross[:, i], prim_count) for i in range(3)])
+        normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, np.newaxis]
+        centers = np.column_stack([np.bincount(vertex_prims, positions[a][:, i], prim_count) for i in range(3)])
+        centers /= np.maximum(counts, 1)[:, np.newaxis]
+        if eye is None:
+            facing = np.ones(prim_count, dtype=bool)
+        else:
+            facing = np.einsum('ij,ij->i', normals, np.asarray(eye) - centers) > 0
+
+        valid = (a != b) & ~open_ends
+        low = np.minimum(a, b)[valid]
+        high = np.maximum(a, b)[valid]
+        prims = vertex_prims[valid]
+        order = np.argsort(low * len(positions) + high, kind='mergesort')
+        low = low[order]
+        high = high[order]
+        prims = prims[order]
+        first = np.ones(len(low), dtype=bool)
+        first[1:] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+        heads = np.flatnonzero(first)
+        uses = np.diff(np.append(heads, len(low)))
+
+        keep = uses != 2
+        shared = np.flatnonzero(uses == 2)
+        face_a = prims[heads[shared]]
+        face_b = prims[heads[shared] + 1]
+        crease = np.einsum('ij,ij->i', normals[face_a], normals[face_b]) < math.cos(math.radians(crease_angle))
+        silhouette = facing[face_a] != facing[face_b]
+        keep[shared] = crease | silhouette
+        return np.column_stack((low[heads[keep]], high[heads[keep]]))
+
+    def createOutlineGhost(self, ghost_geo_folder, ghosts_parts_merge, ghost_shader, ghost_name, current_frame):
+        """Replace frozen ghost meshes with a stash of their outline edges.
+
+        INPUTS:
+        ghost_geo_folder -- ghost folder
+        ghosts_parts_merge -- merge node of the frozen ghost parts
+        ghost_shader -- ghost shader holding the color and width of the ghost
+        ghost_name -- object name from which a new ghost is created
+        current_frame -- frame of the ghost
+
+        OUTPUTS:
+        ghost_style -- node coloring the stashed outline geometry
+        """
+        ghost_unpack = ghost_geo_folder.createNode('unpack', node_name=ghost_name+'_unpack'+'_frame_'+str(current_frame))
+        ghost_unpack.setInput(0, ghosts_parts_merge)
+        ghost_convert = ghost_geo_folder.createNode('convert', node_name=ghost_name+'_convert'+'_frame_'+str(current_frame))
+        ghost_convert.setInput(0, ghost_unpack)
+        vertex_numbers = ghost_geo_folder.createNode('attribwrangle', node_name=ghost_name+'_numbers'+'_frame_'+str(current_frame))
+        vertex_numbers.setInput(0, ghost_convert)
+        vertex_numbers.setParms({"class": 3, "snippet": "i@ib_point = vertexpoint(0, @vtxnum);\ni@ib_prim = vertexprim(0, @vtxnum);\ni@ib_closed = primintrinsic(0, \"closed\", i@ib_prim);"})
+        geo = vertex_numbers.geometry()
+        positions = np.frombuffer(geo.pointFloatAttribValuesAsString("P"), dtype=np.float32).reshape(-1, 3).astype(float)
+        vertex_points = np.frombuffer(geo.vertexIntAttribValuesAsString("ib_point"), dtype=np.int32)
+        vertex_prims = np.frombuffer(geo.vertexIntAttribValuesAsString("ib_prim"), dtype=np.int32)
+        prim_closed = np.zeros(geo.intrinsicValue("primitivecount"), dtype=bool)
+        prim_closed[vertex_prims] = np.frombuffer(geo.vertexIntAttribValuesAsString("ib_closed"), dtype=np.int32) != 0
+        viewer = toolutils.sceneViewer()
+        eye = viewer.curViewport().viewTransform().extractTranslates() if viewer is not None else None
+        edges = self.outlineEdges(positions, vertex_points, vertex_prims, prim_closed, eye)
+
+        used, remapped = np.unique(edges, return_inverse=True)
+        outline = hou.Geometry()
+        outline.createPoints(positions[used].tolist())
+        outline.createPolygons(remapped.reshape(-1, 2).tolist(), False)
+
+        ghost_outline = ghost_geo_folder.createNode('stash', node_name=ghost_name+'_outline'+'_frame_'+str(current_frame))
+        ghost_outline.parm("stash").set(outline)
+        shader_path = "../ghost_shaders/" + ghost_shader.name()
+        ghost_style = ghost_geo_folder.createNode('attribwrangle', node_name=ghost_name+'_style'+'_frame_'+str(current_frame))
+        ghost_style.setInput(0, ghost_outline)
+        ghost_style.setParms({"class": 2, "snippet": 'v@Cd = chv("' + shader_path + '/ogl_spec");\nf@width = (ch("' + shader_path + '/ogl_ior") - 1) * 0.05;'})
+        for node in ghosts_parts_merge.inputs():
+            node.destroy()
+        vertex_numbers.destroy()
+        ghost_convert.destroy()
+        ghost_unpack.destroy()
+        ghosts_parts_merge.destroy()
+        return ghost_style
+
     def createGhost(self, ghost_mat_folder, ghost_geo_folder, ghosts):
         """Creates a new ghost in the ghost folder.
 
@@ -728,19 +1924,23 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                     ghost_merge.parm("xformtype").set(1)
                     ghost_merge.setHardLocked(1)
                     ghosts_parts_merge.setNextInput(ghost_merge)
-                ghost_convert = ghost_geo_folder.createNode('convert', node_name=ghost_name+'_convert'+'_frame_'+str(current_frame))
-                ghost_convert.setInput(0, ghosts_parts_merge)
-                ghost_clean = ghost_geo_folder.createNode('delete', node_name=ghost_name+'_clean'+'_frame_'+str(current_frame))
-                ghost_clean.setInput(0, ghost_convert)
-                ghost_clean.setParms({"negate": 1, "geotype": 17, "pattern": "*"})
-                ghost_frame = ghost_geo_folder.createNode('timeshift', node_name=ghost_name+'_frame'+'_frame_'+str(current_frame))
-                ghost_frame.setInput(0, ghost_clean)
-                ghost_frame.parm("frame").deleteAllKeyframes()
-                ghost_frame.parm("frame").set(current_frame)
                 ghost_shader = self.ghostShaderCreate(ghost_mat_folder, ghost_name)
+                if self.outlineGhosts:
+                    ghost_frame = self.createOutlineGhost(ghost_geo_folder, ghosts_parts_merge, ghost_shader, ghost_name, current_frame)
+                else:
+                    ghost_convert = ghost_geo_folder.createNode('convert', node_name=ghost_name+'_convert'+'_frame_'+str(current_frame))
+                    ghost_convert.setInput(0, ghosts_parts_merge)
+                    ghost_clean = ghost_geo_folder.createNode('delete', node_name=ghost_name+'_clean'+'_frame_'+str(current_frame))
+                    ghost_clean.setInput(0, ghost_convert)
+                    ghost_clean.setParms({"negate": 1, "geotype": 17, "pattern": "*"})
+                    ghost_frame = ghost_geo_folder.createNode('timeshift', node_name=ghost_name+'_frame'+'_frame_'+str(current_frame))
+                    ghost_frame.setInput(0, ghost_clean)
+                    ghost_frame.parm("frame").deleteAllKeyframes()
+                    ghost_frame.parm("frame").set(current_frame)
                 ghost_material = ghost_geo_folder.createNode('material', node_name=ghost_name+'_material'+'_frame_'+str(current_frame))
                 ghost_material.setInput(0, ghost_frame)
-                ghost_material.parm("shop_materialpath1").set("../ghost_shaders/"+ghost_shader.name())
+                if not self.outlineGhosts: #outlines are drawn with their own color and width
+                    ghost_material.parm("shop_materialpath1").set("../ghost_shaders/"+ghost_shader.name())
                 if not hou.node("/obj/InBetween_ghost_folder/ghosts_merge"):
                     ghosts_merge = ghost_geo_folder.createNode('merge', node_name='ghosts_merge')
                     ghosts_merge.setInput(0, ghost_material)
@@ -809,6 +2009,273 @@ class BreakdownKeysInterface(QtWidgets.QWidget):
                     ghost_geo_folder.hide(1)
                     self.createGhost(ghost_mat_folder, ghost_geo_folder, ghosts)
 
+    def animatedParms(self, node):
+        """Return all animated, unlocked float parameters of a given node.
+
+        INPUTS:
+        node -- node to collect parameters from
+
+        OUTPUTS:
+        parms -- list of referenced animated parameters
+        """
+        parms = []
+        for parm in node.parms():
+            parm = parm.getReferencedParm()
+            if len(parm.keyframes()) > 0 and type(parm.eval()) == float and parm.isLocked() == False:
+                parms.append(parm)
+        return parms
+
+    def trailState(self, node):
+        """Describe the keys which drive the world transform of a given node.
+
+        INPUTS:
+        node -- object node
+
+        OUTPUTS:
+        state -- dictionary of key states of the node and all its input ancestors by parameter path
+        """
+        state = {}
+        for item in (node,) + node.inputAncestors():
+            for parm in self.animatedParms(item):
+                layer_parm = self.layerParm(parm)
+                state[parm.path()] = (self.keyState(parm), self.keyState(layer_parm) if layer_parm is not None else ())
+        return state
+
+    def stateSpan(self, old_state, new_state):
+        """Find the frame span whose motion differs between two trail states.
+
+        INPUTS:
+        old_state -- trail state the positions were evaluated from
+        new_state -- current trail state
+
+        OUTPUTS:
+        span -- (start, end) tuple of frames or None if nothing changed
+        """
+        start = float('inf')
+        end = -float('inf')
+        for path in set(old_state) | set(new_state):
+            if old_state.get(path) == new_state.get(path):
+                continue
+            if path not in old_state or path not in new_state or old_state[path][1] != new_state[path][1]:
+                return -float('inf'), float('inf')
+            span = self.changedKeySpan(old_state[path][0], new_state[path][0])
+            start = min(start, span[0])
+            end = max(end, span[1])
+        if start > end:
+            return None
+        return start, end
+
+    def evaluateWorldPositions(self, nodes, frames):
+        """Evaluate world space positions of the given objects over the given frames in one pass.
+
+        INPUTS:
+        nodes -- object nodes
+        frames -- array of frames
+
+        OUTPUTS:
+        positions -- array of shape (nodes, frames, 3)
+        """
+        positions = np.empty((len(nodes), len(frames), 3))
+        for j, frame in enumerate(frames):
+            time = hou.frameToTime(frame)
+            for i, node in enumerate(nodes):
+                positions[i, j] = node.worldTransformAtTime(time).extractTranslates()
+        return positions
+
+    def trailFrames(self):
+        """Return an array of all frames in the playback range."""
+        start, end = hou.playbar.playbackRange()
+        return np.arange(int(start), int(end) + 1, dtype=float)
+
+    def cachedWorldPositions(self, nodes, frames):
+        """Return world space positions of given objects, evaluating only what changed since the last call.
+
+        The key state every trail was evaluated from is stored with it, so only the frames
+        between the keys around the changed ones are evaluated again.
+
+        INPUTS:
+        nodes -- object nodes
+        frames -- array of frames
+
+        OUTPUTS:
+        positions -- list of (frames, 3) position arrays
+        """
+        full = []
+        partial = {}
+        for node in nodes:
+            state = self.trailState(node)
+            cached = self.trailCache.get(node.path())
+            if cached is None or not np.array_equal(cached['frames'], frames):
+                full.append((node, state))
+                continue
+            span = self.stateSpan(cached['state'], state)
+            if span == (-float('inf'), float('inf')):
+                full.append((node, state))
+            elif span is not None:
+                partial.setdefault(span, []).append((node, state))
+        if full:
+            positions = self.evaluateWorldPositions([node for node, state in full], frames)
+            for i, (node, state) in enumerate(full):
+                self.trailCache[node.path()] = {'frames': frames, 'state': state, 'positions': positions[i]}
+        for span in partial:
+            mask = (frames >= span[0]) & (frames <= span[1])
+            positions = self.evaluateWorldPositions([node for node, state in partial[span]], frames[mask])
+            for i, (node, state) in enumerate(partial[span]):
+                cached = self.trailCache[node.path()]
+                cached['positions'][mask] = positions[i]
+                cached['state'] = state
+        return [self.trailCache[node.path()]['positions'] for node in nodes]
+
+    def updateMotionTrails(self):
+        """Refresh motion trails of the selected objects and redraw them."""
+        if not self.trailsEnabled:
+            return
+        nodes = [node for node in hou.selectedNodes() if isinstance(node, hou.ObjNode)]
+        self.drawMotionTrails(self.cachedWorldPositions(nodes, self.trailFrames()))
+
+    def buildTrailGeometry(self, trails):
+        """Build a polyline with frame ticks for every given trail.
+
+        INPUTS:
+        trails -- list of (frames, 3) position arrays
+
+        OUTPUTS:
+        geo -- new geometry object
+        """
+        geo = hou.Geometry()
+        for trail in trails:
+            if len(trail) < 2:
+                continue
+            tangents = np.gradient(trail, axis=0)
+            sides = np.cross(tangents, (0.0, 1.0, 0.0))
+            flat = np.linalg.norm(sides, axis=1) < 1e-6
+            sides[flat] = np.cross(tangents[flat], (1.0, 0.0, 0.0))
+            lengths = np.linalg.norm(sides, axis=1)
+            lengths[lengths == 0] = 1.0
+            tick_size = max(np.ptp(trail, axis=0).max(), 1e-3) * 0.01
+            sides *= (tick_size / lengths)[:, np.newaxis]
+            ticks = np.empty((len(trail) * 2, 3))
+            ticks[0::2] = trail - sides
+            ticks[1::2] = trail + sides
+            points = geo.createPoints(np.concatenate((trail, ticks)).tolist())
+            numbers = [point.number() for point in points]
+            count = len(trail)
+            polylines = [numbers[:count]]
+            polylines.extend(numbers[count + i:count + i + 2] for i in range(0, count * 2, 2))
+            geo.createPolygons(polylines, False)
+        return geo
+
+    def drawMotionTrails(self, trails):
+        """Draw given trails in the current scene viewer as a single geometry.
+
+        INPUTS:
+        trails -- list of (frames, 3) position arrays
+        """
+        self.clearMotionTrails()
+        viewer = toolutils.sceneViewer()
+        if viewer is None or not trails:
+            return
+        drawable = hou.SimpleDrawable(viewer, self.buildTrailGeometry(trails), "InBetween_motion_trail")
+        drawable.setDisplayMode(hou.drawableDisplayMode.WireframeMode)
+        drawable.setWireframeColor(hou.Color((0.9, 0.55, 0.05)))
+        drawable.enable(True)
+        drawable.show(True)
+        self.trailDrawables.append(drawable)
+
+    def clearMotionTrails(self):
+        """Remove all motion trails from the viewer."""
+        for drawable in self.trailDrawables:
+            drawable.show(False)
+            drawable.enable(False)
+        self.trailDrawables = []
+
+    def toggleMotionTrails(self):
+        """Turn motion trails of the selected objects on or off."""
+        self.trailsEnabled = not self.trailsEnabled
+        if self.trailsEnabled:
+            self.updateMotionTrails()
+        else:
+            self.clearMotionTrails()
+            self.trailCache = {}
+
+    def keysEdited(self):
+        """Update everything cached from the animation after the panel wrote keys."""
+        self.updateMotionTrails()
+        self.updateSpacingChart()
+        if self.trailsEnabled or self.spacingChart.isVisible():
+            self.animationSignature = self.animationFingerprint()
+
+    def animationFingerprint(self):
+        """Return a cheap summary of the selection and of the keys driving it.
+
+        Only key counts and key ranges are read, so comparing fingerprints costs far less
+        than building the key states of the trails.
+
+        OUTPUTS:
+        fingerprint -- tuple of selected paths and (path, key count, first frame, last frame) tuples
+        """
+        nodes = [node for node in hou.selectedNodes() if isinstance(node, hou.ObjNode)]
+        channels = []
+        for node in nodes + [ancestor for node in nodes for ancestor in node.inputAncestors()]:
+            for parm in node.parms():
+                keys = parm.getReferencedParm().keyframes()
+                if keys:
+                    channels.append((parm.path(), len(keys), keys[0].frame(), keys[-1].frame()))
+        return tuple(node.path() for node in nodes), tuple(channels)
+
+    def keyState(self, parm):
+        """Return every key property of a parameter that changes its curve.
+
+        INPUTS:
+        parm -- animated parameter
+
+        OUTPUTS:
+        state -- tuple of key tuples
+        """
+        return tuple((key.frame(), key.value(), key.inSlope(), key.slope(), key.inAccel(), key.accel(), key.expression()) for key in parm.keyframes())
+
+    def changedKeySpan(self, old_state, new_state):
+        """Find the frame span whose curve differs between two key states.
+
+        A curve segment only depends on its two keys, so the span reaches from the key
+        before the first changed key to the key after the last one.
+
+        INPUTS:
+        old_state -- key state the samples were taken from
+        new_state -- current key state
+
+        OUTPUTS:
+        span -- (start, end) tuple of frames or None if nothing changed
+        """
+        old_keys = dict((key[0], key) for key in old_state)
+        new_keys = dict((key[0], key) for key in new_state)
+        frames = sorted(set(old_keys) | set(new_keys))
+        changed = [i for i, frame in enumerate(frames) if old_keys.get(frame) != new_keys.get(frame)]
+        if not changed:
+            return None
+        start = frames[changed[0] - 1] if changed[0] > 0 else -float('inf')
+        end = frames[changed[-1] + 1] if changed[-1] + 1 < len(frames) else float('inf')
+        return start, end
+
+    def updateSpacingChart(self):
+        """Recalculate world space displacement, velocity and acceleration of the selected controls."""
+        if not self.spacingChart.isVisible():
+            return
+        frames = self.trailFrames()
+        nodes = [node for node in hou.selectedNodes() if isinstance(node, hou.ObjNode)]
+        positions = np.array(self.cachedWorldPositions(nodes, frames)).reshape(len(nodes), len(frames), 3)
+        steps = np.linalg.norm(np.diff(positions, axis=1), axis=2)
+        velocity = np.concatenate(([0.0], steps.mean(axis=0) if len(nodes) else np.zeros(len(frames) - 1)))
+        displacement = np.cumsum(velocity)
+        acceleration = np.gradient(velocity) if len(frames) > 1 else np.zeros(len(frames))
+        keyFrames = np.unique([key.frame() for node in nodes for parm in self.animatedParms(node) for key in parm.keyframes()])
+        self.spacingChart.setData(frames, displacement, velocity, acceleration, keyFrames)
+
+    def toggleSpacingChart(self):
+        """Show or hide the spacing chart."""
+        self.spacingChart.setVisible(not self.spacingChart.isVisible())
+        self.updateSpacingChart()
+
     def locationChooser(self, menu):
         """Choose location for a new selection set item in radial menu
         